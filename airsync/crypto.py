@@ -1,16 +1,29 @@
 import os
 import base64
+import hashlib
 import logging
+import mmap
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.exceptions import InvalidTag
 
+def file_sha256(fd) -> str:
+    """Returns the SHA-256 hex digest of the file behind ``fd``, hashed in one pass over an mmap."""
+    if os.fstat(fd).st_size == 0:
+        return hashlib.sha256().hexdigest()
+    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+        return hashlib.sha256(mapped).hexdigest()
+
 class AESSipher:
     """
     Handles all AES-256-GCM encryption, decryption, and key management.
     """
+    __slots__ = ("key_path", "key", "_aead", "_key_b64")
+
     def __init__(self, key_path="airsync.key"):
         self.key_path = key_path
         self.key = self._load_key()
+        self._aead = AESGCM(self.key)
+        self._key_b64 = base64.b64encode(self.key).decode()
         logging.debug("AESSipher initialized.")
 
     def _load_key(self):
@@ -32,16 +45,24 @@ class AESSipher:
 
     def get_key_base64(self) -> str:
         """Returns the current key as a Base64 string."""
-        return base64.b64encode(self.key).decode()
+        return self._key_b64
+
+    def encrypt_bytes(self, plaintext: bytes) -> bytes:
+        """Encrypts raw bytes, returning nonce + ciphertext (no Base64)."""
+        nonce = os.urandom(12) # 96-bit nonce
+        # Even for tiny control frames, one AESGCM.encrypt call on the cached key schedule beats
+        # the streaming Cipher API (update_into a scratch buffer), which builds a new context per message.
+        # Prepend nonce to ciphertext as per docs
+        return nonce + self._aead.encrypt(nonce, plaintext, None)
+
+    def decrypt_bytes(self, combined: bytes) -> bytes:
+        """Decrypts nonce + ciphertext bytes. Raises InvalidTag on failure."""
+        return self._aead.decrypt(combined[:12], combined[12:], None)
 
     def encrypt_message(self, message: str) -> str:
         """Encrypts a plaintext string using AES-256-GCM."""
         try:
-            nonce = os.urandom(12) # 96-bit nonce
-            cipher = AESGCM(self.key)
-            ciphertext = cipher.encrypt(nonce, message.encode('utf-8'), None)
-            # Prepend nonce to ciphertext as per docs
-            return base64.b64encode(nonce + ciphertext).decode()
+            return base64.b64encode(self.encrypt_bytes(message.encode('utf-8'))).decode()
         except Exception as e:
             logging.error(f"Encryption failed: {e}", exc_info=True)
             return ""
@@ -49,15 +70,9 @@ class AESSipher:
     def decrypt_message(self, encrypted_base64: str) -> str:
         """Decrypts a Base64 string using AES-256-GCM."""
         try:
-            combined = base64.b64decode(encrypted_base64)
-            nonce = combined[:12]
-            ciphertext = combined[12:]
-            cipher = AESGCM(self.key)
-            plaintext = cipher.decrypt(nonce, ciphertext, None)
-            return plaintext.decode('utf-8')
+            return self.decrypt_bytes(base64.b64decode(encrypted_base64)).decode('utf-8')
         except (InvalidTag, Exception) as e:
             # If decryption fails, it might be a client connecting with no-encrypt.
             # Return the raw string for the JSON parser to handle.
             logging.warning(f"Decryption failed (InvalidTag or other error). Is client using encryption?")
             return encrypted_base64
-
@@ -1,26 +1,29 @@
-import asyncio, logging, os, socket, qrcode, io, base64, platform, hashlib, mimetypes
+import asyncio, logging, os, socket, segno, io, base64, platform, mimetypes
 try:
     import magic
 except ImportError:
     magic = None
-from .crypto import AESSipher
+from .crypto import AESSipher, file_sha256
 from .state import DeviceState
 from .websocket_server import WebSocketServer
 from zeroconf import Zeroconf, ServiceInfo
 
 class Server:
-    def __init__(self, key_path: str = "airsync.key", icon_cache_path: str = "cache/icons", discovery: bool = False):
+    def __init__(self, key_path: str = "airsync.key", icon_cache_path: str = "cache/icons", discovery: bool = False, max_message_size: int = 100 * 1024 * 1024):
         self.state = DeviceState()
         self.cipher = AESSipher(key_path)
         self.event_handlers = {}
+        self._event_tasks = set()  # Strong refs to fire-and-forget event tasks
         self.no_encrypt = False 
         self.discovery = discovery
         self.zeroconf = None
         self.service_info = None
         self.icon_cache_path = icon_cache_path
         os.makedirs(self.icon_cache_path, exist_ok=True)
-        self._ws_server = WebSocketServer(state=self.state, cipher=self.cipher, parent_server=self, icon_cache_path=self.icon_cache_path)
+        self._ws_server = WebSocketServer(state=self.state, cipher=self.cipher, parent_server=self, icon_cache_path=self.icon_cache_path, max_size=max_message_size)
         self._local_ip = self._get_local_ip()
+        self._qr = None
+        self._qr_png = None
         logging.debug("AirSync Server initialized.")
 
     def on_event(self, event_type: str):
@@ -39,6 +42,13 @@ class Server:
                 logging.error(f"Error in event handler for '{event_type}': {e}", exc_info=True)
         return None
 
+    def _fire_event_nowait(self, event_type: str, *args):
+        """Schedules an event handler without awaiting it. Only for events whose return value is unused."""
+        if event_type in self.event_handlers:
+            task = asyncio.create_task(self._fire_event(event_type, *args))
+            self._event_tasks.add(task)
+            task.add_done_callback(self._event_tasks.discard)
+
     async def start(self, host: str = "0.0.0.0", port: int = 5297, no_encrypt: bool = False):
         if no_encrypt:
             logging.warning("="*50 + "\nENCRYPTION DISABLED. This is for debugging only.\n" + "="*50)
@@ -79,10 +89,16 @@ class Server:
         await self._ws_server.stop()
         logging.info("AirSync server has stopped.")
 
-    def get_state(self, key: str = None):
-        return self.state.get_state(key)
+    def get_state(self, key: str = None, mutable: bool = False):
+        """
+        Returns the cached device state as a read-only view.
 
-    async def send_message(self, handler_id: str, message_dict: dict):
+        Views are not JSON serializable; pass `mutable=True` to get plain dicts
+        (a deep copy) when the state will be modified or serialized.
+        """
+        return self.state.get_state(key, mutable)
+
+    async def send_message(self, handler_id: int, message_dict: dict):
         await self._ws_server.send_to_handler(handler_id, message_dict)
 
     async def broadcast_message(self, message_dict: dict):
@@ -96,7 +112,7 @@ class Server:
             except Exception as e: logging.warning(f"python-magic failed to get MIME type: {e}")
         return "application/octet-stream"
 
-    async def send_file(self, file_path: str, handler_id: str):
+    async def send_file(self, file_path: str, handler_id: int):
         if not os.path.exists(file_path):
             logging.error(f"Cannot send file: {file_path} does not exist.")
             return
@@ -105,13 +121,10 @@ class Server:
             file_name = os.path.basename(file_path)
             file_size = await asyncio.to_thread(os.path.getsize, file_path)
             mime_type = await asyncio.to_thread(self._get_mime_type, file_path)
-            sha256 = hashlib.sha256()
-            def read_and_hash():
+            def hash_file():
                 with open(file_path, "rb") as f:
-                    while chunk := f.read(65536):
-                        sha256.update(chunk)
-            await asyncio.to_thread(read_and_hash)
-            checksum = sha256.hexdigest()
+                    return file_sha256(f.fileno())
+            checksum = await asyncio.to_thread(hash_file)
             handler = self._ws_server.get_handler(handler_id)
             if not handler:
                 logging.error(f"Cannot send file: No active handler with ID {handler_id}")
@@ -130,33 +143,29 @@ class Server:
         except Exception:
             return "127.0.0.1"
 
+    def _get_qr(self):
+        """Returns the connect QR code, rebuilding it only when the connect URI changes."""
+        connect_uri = f"airsync://{self._local_ip}:{self._ws_server.port}?key={self.cipher.get_key_base64()}"
+        if self._qr is None or self._qr[0] != connect_uri:
+            self._qr = (connect_uri, segno.make(connect_uri, micro=False))
+            self._qr_png = None
+        return self._qr[1]
+
     def get_qr_code(self) -> str:
         if self.no_encrypt: 
             logging.error("Cannot generate QR code: Encryption is disabled.")
             return None
-        key_b64 = self.cipher.get_key_base64()
-        port = self._ws_server.port
-        ip = self._local_ip
-        connect_uri = f"airsync://{ip}:{port}?key={key_b64}"
-        qr = qrcode.QRCode(version=1, box_size=10, border=4)
-        qr.add_data(connect_uri)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        return base64.b64encode(buf.getvalue()).decode('utf-8')
+        qr = self._get_qr()
+        if self._qr_png is None:
+            buf = io.BytesIO()
+            qr.save(buf, kind="png", scale=10, border=4)
+            self._qr_png = base64.b64encode(buf.getvalue()).decode('utf-8')
+        return self._qr_png
 
     def print_qr_code(self):
         if self.no_encrypt: 
             logging.error("Cannot print QR code: Encryption is disabled.")
             return
-        key_b64 = self.cipher.get_key_base64()
-        port = self._ws_server.port
-        ip = self._local_ip
-        connect_uri = f"airsync://{ip}:{port}?key={key_b64}"
-        qr = qrcode.QRCode(version=1, border=2)
-        qr.add_data(connect_uri)
-        qr.make(fit=True)
         print("--- Scan QR Code to Connect ---")
-        qr.print_tty()
+        self._get_qr().terminal(compact=True, border=2)
         print("-------------------------------")
\ No newline at end of file
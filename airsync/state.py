@@ -1,6 +1,24 @@
 import threading
 import logging
-from copy import deepcopy
+from types import MappingProxyType
+
+_EMPTY = MappingProxyType({})
+
+def _read_only(value):
+    """Copies `value` with nested dicts as MappingProxyType and lists as tuples. Already-frozen parts are reused."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _read_only(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_read_only(v) for v in value)
+    return value
+
+def _mutable(value):
+    """Inverse of _read_only: a deep copy made of plain dicts and lists."""
+    if isinstance(value, (dict, MappingProxyType)):
+        return {k: _mutable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_mutable(v) for v in value]
+    return value
 
 class DeviceState:
     """
@@ -8,24 +26,38 @@ class DeviceState:
     
     This allows the developer to query the state (e.g., for widgets)
     without directly polling the device.
+
+    Values are frozen once when written (dicts become MappingProxyType, lists
+    tuples) and every write swaps in a new top-level dict, so readers can be
+    handed the current snapshot directly instead of a copy.
     """
+    __slots__ = ("_lock", "_state", "_app_icon_keys")
+
     def __init__(self):
         self._lock = threading.Lock()
         self._state = {
-            "device_info": {},    # From 'device' message
-            "status": {},         # From 'status' message (battery, music)
-            "notifications": {},  # Map of {notif_id: notif_data}
-            "app_icons": {},      # Map of {package_name: icon_data}
-            "clipboard": {},      # From 'clipboardUpdate' message
+            "device_info": _EMPTY,    # From 'device' message
+            "status": _EMPTY,         # From 'status' message (battery, music)
+            "notifications": _EMPTY,  # Map of {notif_id: notif_data}
+            "app_icons": _EMPTY,      # Map of {package_name: icon_data}
+            "clipboard": _EMPTY,      # From 'clipboardUpdate' message
         }
+        self._app_icon_keys = ()  # Cached package names of "app_icons", rebuilt on write
         logging.debug("DeviceState initialized.")
 
+    def _replace(self, key, value):
+        """Publishes a new snapshot with `key` set to a frozen copy of `value`. Caller must hold the lock."""
+        value = _read_only(value)
+        self._state = {**self._state, key: value}
+        if key == "app_icons":
+            self._app_icon_keys = tuple(value)
+
     def set_device_info(self, data):
         """Sets the initial device info."""
         with self._lock:
             # For now, we only support one device's state.
             # A future improvement could manage state per-handler_id.
-            self._state["device_info"] = data
+            self._replace("device_info", data)
             logging.info(f"State: Device info set for {data.get('name')}")
 
     def update_state(self, key, data):
@@ -34,21 +66,23 @@ class DeviceState:
             if key == "notification":
                 notif_id = data.get("id")
                 if notif_id:
-                    self._state["notifications"][notif_id] = data
+                    self._replace("notifications", {**self._state["notifications"], notif_id: data})
                     logging.debug(f"State: Added notification {notif_id}")
             elif key == "notificationUpdate":
                 notif_id = data.get("id")
                 if data.get("dismissed") and notif_id in self._state["notifications"]:
-                    del self._state["notifications"][notif_id]
+                    notifications = dict(self._state["notifications"])
+                    del notifications[notif_id]
+                    self._replace("notifications", notifications)
                     logging.debug(f"State: Dismissed notification {notif_id}")
             elif key == "appIcons":
-                self._state["app_icons"].update(data)
+                self._replace("app_icons", {**self._state["app_icons"], **data})
                 logging.info(f"State: App icons updated. Total apps: {len(self._state['app_icons'])}")
             elif key == "clipboardUpdate":
-                self._state["clipboard"] = data
+                self._replace("clipboard", data)
                 logging.info("State: Clipboard updated.")
             elif key in self._state:
-                self._state[key] = data
+                self._replace(key, data)
                 logging.debug(f"State: Updated key '{key}'")
             else:
                 # --- ADDED ---
@@ -57,17 +91,21 @@ class DeviceState:
                 logging.debug(f"State: Ignoring update for unknown key '{key}'")
                 # --- END ADDED ---
 
-    def get_state(self, key=None):
+    def get_app_icon_keys(self):
+        """Returns the package names with cached app icons, as a tuple."""
+        with self._lock:
+            return self._app_icon_keys
+
+    def get_state(self, key=None, mutable=False):
         """
-        Gets a deepcopy of the state.
+        Gets the cached state.
         
         :param key: (Optional) The specific state key to retrieve.
-        :return: A (deep)copy of the state dictionary.
+        :param mutable: (Optional) Return a deep copy of plain dicts and lists the caller may modify.
+        :return: A read-only view of the state (nested maps included), or a deep copy if `mutable` is set.
         """
         with self._lock:
-            if key:
-                # Use deepcopy to prevent consumer from mutating the cache
-                return deepcopy(self._state.get(key, {}))
-            return deepcopy(self._state)
-
-
+            state = self._state.get(key, _EMPTY) if key else self._state
+        if mutable:
+            return _mutable(state)
+        return MappingProxyType(state) if isinstance(state, dict) else state
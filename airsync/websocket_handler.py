@@ -1,64 +1,215 @@
-import asyncio, json, logging, os, base64, binascii, hashlib, tempfile, uuid
-from websockets.exceptions import ConnectionClosed
+import asyncio, itertools, json, logging, os, binascii, struct, tempfile, uuid
+from cryptography.exceptions import InvalidTag
+from .crypto import file_sha256
+from websockets.exceptions import ConnectionClosed, ConnectionClosedOK
+try:
+    from pybase64 import b64decode as _b64decode, b64encode as _b64encode
+except ImportError:
+    from base64 import b64decode as _b64decode, b64encode as _b64encode
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson:
+    def _dumps(obj): return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    _loads = orjson.loads
+else:
+    def _dumps(obj): return json.dumps(obj, separators=(",", ":")).encode('utf-8')
+    _loads = json.loads
+
+# Optional protocol extensions. A client opts in by listing them in the 'device'
+# message's "capabilities" field; 'macInfo' echoes back the ones this connection uses.
+# "binaryFrames": messages travel as binary frames carrying the raw
+# nonce + ciphertext (or plain UTF-8 JSON with no-encrypt) instead of Base64 text.
+# "fileChunkBin": file chunks travel as binary frames whose (decrypted) payload is
+# 0x01 | id length (1 byte) | UTF-8 transfer id | chunk index (u32 BE) | raw bytes.
+# Binary chunks may be up to _BINARY_CHUNK_SIZE bytes, so each one costs a single
+# AES-GCM call instead of one per 64 KiB. Chunk bodies are always encrypted: the
+# transport is plain ws://, and a per-chunk SHA-256 "header MAC" would cost more
+# per byte than the GHASH it replaces.
+SUPPORTED_CAPABILITIES = ("binaryFrames", "fileChunkBin")
+_FRAME_FILE_CHUNK = 0x01
+_CHUNK_INDEX = struct.Struct(">I")
+_URLSAFE_TABLE = bytes.maketrans(b"-_", b"+/")
+_TEXT_CHUNK_SIZE = 64 * 1024
+_BINARY_CHUNK_SIZE = 4 * 1024 * 1024
+# Per-chunk ack timeout is a fixed allowance plus time to move the chunk at a minimum rate;
+# the rate keeps the old floor (a 64 KiB chunk in 10 s), so 4 MiB chunks don't need a faster link.
+_ACK_TIMEOUT_BASE = 10.0
+_ACK_MIN_BYTES_PER_SEC = 8 * 1024
+# Message types that must be handled in arrival order (file transfers, and events whose
+# callbacks must not overtake each other: a dismissal before its notification, a stale status
+# or clipboard over a newer one, media commands out of sequence). Only appIcons and the log-only
+# responses run as bounded concurrent tasks, so icon caching doesn't stall the socket.
+_ORDERED_MESSAGES = frozenset({"device", "status", "notification", "notificationUpdate", "clipboardUpdate", "macMediaControl",
+                               "fileTransferInit", "fileChunk", "fileChunkAck", "fileTransferComplete", "transferVerified"})
+_MAX_CONCURRENT_HANDLERS = 16
+# Incoming chunks are buffered and flushed with one writev once either limit is hit.
+_WRITE_BATCH_CHUNKS = 16
+_WRITE_BATCH_BYTES = 1024 * 1024
+
+def _write_chunks(fd, chunks):
+    """Writes `chunks` to `fd` with a single writev where available, finishing any short write."""
+    written = os.writev(fd, chunks) if hasattr(os, "writev") else 0
+    if written < sum(map(len, chunks)):
+        remaining = memoryview(b"".join(chunks))[written:]
+        while remaining:
+            remaining = remaining[os.write(fd, remaining):]
+
+_READ_WINDOW = 8 * 1024 * 1024
+
+def _iter_file_chunks(f, chunk_size):
+    """Yields memoryview chunks of `f` read into one reused buffer; each is valid only until the next."""
+    window = memoryview(bytearray(max(chunk_size, _READ_WINDOW - _READ_WINDOW % chunk_size)))
+    while filled := f.readinto(window):
+        for offset in range(0, filled, chunk_size):
+            yield window[offset:min(offset + chunk_size, filled)]
+
+def _remove_quietly(path):
+    """Deletes `path`, logging instead of raising if it is already gone or can't be removed."""
+    try:
+        os.remove(path)
+    except OSError as e:
+        logging.warning(f"Failed to remove {path}: {e}")
+
+def _discard_incoming(transfer):
+    """Closes and deletes a partially received file."""
+    os.close(transfer["fd"])
+    _remove_quietly(transfer["path"])
+
+# mkstemp creates files as 0600; received downloads get the mode a plain open() would give them.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# Process-wide handler ids; starts at 1 so every id is truthy.
+_handler_ids = itertools.count(1)
 
 class WebSocketHandler:
-    def __init__(self, websocket, state, cipher, no_encrypt, parent_server, icon_cache_path):
+    # Subclasses that add attributes must declare their own __slots__.
+    __slots__ = ("ws", "state", "cipher", "no_encrypt", "parent_server", "ws_server", "icon_cache_path", "handler_id",
+                 "is_authenticated", "capabilities", "file_transfers", "_tasks", "_task_slots")
+
+    def __init__(self, websocket, state, cipher, no_encrypt, parent_server, icon_cache_path, ws_server):
         self.ws = websocket
         self.state = state
         self.cipher = cipher
         self.no_encrypt = no_encrypt
         self.parent_server = parent_server
+        self.ws_server = ws_server
         self.icon_cache_path = icon_cache_path
-        self.handler_id = str(id(self))
+        self.handler_id = next(_handler_ids)
         self.is_authenticated = False
+        self.capabilities = frozenset()
         self.file_transfers = {}
+        self._tasks = set()
+        self._task_slots = asyncio.Semaphore(_MAX_CONCURRENT_HANDLERS)
         logging.debug(f"Handler {self.handler_id} created for {self.ws.remote_address}")
 
+    @staticmethod
+    def encode(message_dict: dict) -> bytes:
+        """JSON-encodes a message exactly as send() would, for callers that fan one payload out via send_prepared()."""
+        return _dumps(message_dict)
+
     async def send(self, message_dict: dict):
+        try:
+            payload = _dumps(message_dict)
+        except Exception as e:
+            logging.warning(f"Handler {self.handler_id}: Failed to encode message: {e}")
+            return
+        await self.send_prepared(payload)
+
+    async def send_prepared(self, payload: bytes):
+        """Sends an already JSON-encoded message, encrypting and framing it for this client."""
         if self.ws.closed:
             return
         try:
-            message_str = json.dumps(message_dict)
-            if not self.no_encrypt:
-                message_str = self.cipher.encrypt_message(message_str)
-            await self.ws.send(message_str)
+            if "binaryFrames" in self.capabilities:
+                message = payload if self.no_encrypt else self.cipher.encrypt_bytes(payload)
+            elif self.no_encrypt:
+                message = payload.decode('utf-8')
+            else:
+                message = _b64encode(self.cipher.encrypt_bytes(payload)).decode('ascii')
+            await self.ws.send(message)
         except ConnectionClosed:
             logging.info(f"Handler {self.handler_id}: Connection closed while trying to send.")
         except Exception as e:
             logging.warning(f"Handler {self.handler_id}: Failed to send message: {e}")
 
+    async def send_binary(self, payload: bytes):
+        if self.ws.closed:
+            return
+        try:
+            await self.ws.send(payload if self.no_encrypt else self.cipher.encrypt_bytes(payload))
+        except ConnectionClosed:
+            logging.info(f"Handler {self.handler_id}: Connection closed while trying to send.")
+        except Exception as e:
+            logging.warning(f"Handler {self.handler_id}: Failed to send binary frame: {e}")
+
     async def listen(self):
         logging.info(f"Handler {self.handler_id}: New connection from {self.ws.remote_address}")
         try:
             async for message_str in self.ws:
                 try:
-                    if not self.no_encrypt:
+                    if isinstance(message_str, (bytes, bytearray)):
+                        if not self.no_encrypt:
+                            message_str = self.cipher.decrypt_bytes(message_str)
+                        if message_str and message_str[0] == _FRAME_FILE_CHUNK:
+                            if not self.is_authenticated:
+                                await self.close(code=1002, reason="Protocol violation: first message must be 'device'")
+                                return
+                            await self.handle_binary_frame(message_str)
+                            continue
+                    elif not self.no_encrypt:
                         message_str = self.cipher.decrypt_message(message_str)
                     if not message_str: continue
-                    msg = json.loads(message_str)
+                    msg = _loads(message_str)
                     msg_type, data = msg.get("type"), msg.get("data", {})
                     if not self.is_authenticated and msg_type != "device":
                         await self.close(code=1002, reason="Protocol violation: first message must be 'device'")
                         return
-                    handler_method = getattr(self, f"handle_{msg_type}", self.handle_unknown)
-                    await handler_method(data)
+                    handler_method = self._DISPATCH.get(msg_type, WebSocketHandler.handle_unknown)
+                    if msg_type in _ORDERED_MESSAGES:
+                        await handler_method(self, data)
+                    else:
+                        # Waiting for a free slot here applies backpressure to the read loop.
+                        await self._task_slots.acquire()
+                        task = asyncio.create_task(self._run_handler(handler_method, data))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+                except InvalidTag:
+                    logging.warning(f"Handler {self.handler_id}: Dropping binary frame that failed decryption.")
                 except json.JSONDecodeError:
                     logging.warning(f"Handler {self.handler_id}: Received invalid JSON: {message_str[:100]}...")
                 except Exception as e:
                     logging.error(f"Handler {self.handler_id}: Error handling message: {e}", exc_info=True)
-        except ConnectionClosed:
+        except ConnectionClosedOK:
             logging.info(f"Handler {self.handler_id}: Connection from {self.ws.remote_address} closed cleanly.")
+        except ConnectionClosed as e:
+            # websockets reports resets and dropped sockets as ConnectionClosedError; expected, so no traceback.
+            code = e.rcvd.code if e.rcvd else 1006  # 1006: no close frame received
+            logging.info(f"Handler {self.handler_id}: Connection from {self.ws.remote_address} lost (code {code}).")
         except Exception as e:
             logging.error(f"Handler {self.handler_id}: Listen loop error: {e}", exc_info=True)
         finally:
+            for task in self._tasks:
+                task.cancel()
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
             for tf_id, transfer in self.file_transfers.items():
-                if "handle" in transfer:
+                if "fd" in transfer:
                     logging.warning(f"Cleaning up incomplete incoming file transfer: {tf_id}")
-                    await asyncio.to_thread(transfer["handle"].close)
-                    if os.path.exists(transfer["path"]):
-                        await asyncio.to_thread(os.remove, transfer["path"])
+                    await asyncio.to_thread(_discard_incoming, transfer)
             self.file_transfers.clear()
 
+    async def _run_handler(self, handler_method, data):
+        try:
+            await handler_method(self, data)
+        except Exception as e:
+            logging.error(f"Handler {self.handler_id}: Error handling message: {e}", exc_info=True)
+        finally:
+            self._task_slots.release()
+
     async def close(self, code=1000, reason="Closing connection"):
         if not self.ws.closed:
             try:
@@ -72,12 +223,14 @@ class WebSocketHandler:
             return
         logging.info(f"Handler {self.handler_id}: Device handshake received: {data.get('name')}")
         self.state.set_device_info(data)
+        self.capabilities = frozenset(SUPPORTED_CAPABILITIES).intersection(data.get("capabilities") or ())
         self.is_authenticated = True
+        self.ws_server.mark_authenticated(self)
         try:
             mac_info_data = await self.parent_server._fire_event("mac_info_request", self.handler_id, data)
             if not mac_info_data: raise Exception("'mac_info_request' handler returned None or empty data.")
-            app_icons_state = self.state.get_state("app_icons")
-            mac_info_data["savedAppPackages"] = list(app_icons_state.keys())
+            mac_info_data["savedAppPackages"] = list(self.state.get_app_icon_keys())
+            mac_info_data["capabilities"] = sorted(self.capabilities)
             await self.send({"type": "macInfo", "data": mac_info_data})
             await self.parent_server._fire_event("device_connected", self.handler_id)
         except Exception as e:
@@ -106,58 +259,73 @@ class WebSocketHandler:
 
     async def handle_appIcons(self, data):
         logging.info(f"Handler {self.handler_id}: Received appIcons message with {len(data)} icons.")
-        app_icons_metadata, cached_count = {}, 0
+        app_icons_metadata, pending_icons = {}, {}
         for package_name, icon_data in data.items():
             icon_b64_raw = icon_data.get('icon')
             app_icons_metadata[package_name] = { "name": icon_data.get("name"), "systemApp": icon_data.get("systemApp"), "listening": icon_data.get("listening") }
             if not icon_b64_raw: continue
             icon_path = os.path.join(self.icon_cache_path, f"{package_name}.png")
+            # A stat on the local cache dir is far cheaper than a thread hop, so do it inline.
             try:
-                file_exists = await asyncio.to_thread(os.path.exists, icon_path)
-                file_size = await asyncio.to_thread(os.path.getsize, icon_path) if file_exists else 0
-                if not file_exists or file_size == 0:
-                    icon_b64_data = icon_b64_raw.split(',', 1)[1] if "," in icon_b64_raw else icon_b64_raw
-                    icon_b64_data = icon_b64_data.strip().replace("-", "+").replace("_", "/")
-                    icon_b64_padded = icon_b64_data + ('=' * (-len(icon_b64_data) % 4))
-                    decoded_data = await asyncio.to_thread(base64.b64decode, icon_b64_padded)
-                    dir_name = os.path.dirname(icon_path)
-                    if not await asyncio.to_thread(os.path.exists, dir_name):
-                        await asyncio.to_thread(os.makedirs, dir_name, exist_ok=True)
-                    
-                    def write_file():
-                        with open(icon_path, "wb") as f: f.write(decoded_data)
-                    await asyncio.to_thread(write_file)
-                    cached_count += 1
-            except binascii.Error as e: logging.error(f"Failed to cache icon for {package_name}: {e}.")
-            except Exception as e: logging.error(f"Failed to cache icon for {package_name}: {e}")
+                if os.path.getsize(icon_path) > 0: continue
+            except OSError:
+                pass
+            pending_icons[package_name] = (icon_path, icon_b64_raw)
+        cached_count = await asyncio.to_thread(self._write_icons, pending_icons) if pending_icons else 0
         logging.info(f"App icon caching complete. Wrote {cached_count} new icons to cache.")
         self.state.update_state("app_icons", app_icons_metadata)
         await self.parent_server._fire_event("app_icons", app_icons_metadata, self.handler_id)
 
+    @staticmethod
+    def _write_icons(pending_icons):
+        """Decodes and writes a batch of icons. Runs in a worker thread; returns the number written."""
+        cached_count = 0
+        for package_name, (icon_path, icon_b64_raw) in pending_icons.items():
+            try:
+                icon_b64_data = icon_b64_raw.encode('ascii')
+                icon_b64_data = icon_b64_data.split(b',', 1)[1] if b"," in icon_b64_data else icon_b64_data
+                # One C-level pass maps URL-safe Base64 onto the standard alphabet.
+                icon_b64_data = icon_b64_data.strip().translate(_URLSAFE_TABLE)
+                icon_b64_padded = icon_b64_data + (b'=' * (-len(icon_b64_data) % 4))
+                decoded_data = _b64decode(icon_b64_padded, validate=False)
+                with open(icon_path, "wb") as f: f.write(decoded_data)
+                cached_count += 1
+            except binascii.Error as e: logging.error(f"Failed to cache icon for {package_name}: {e}.")
+            except Exception as e: logging.error(f"Failed to cache icon for {package_name}: {e}")
+        return cached_count
+
     async def handle_clipboardUpdate(self, data):
         self.state.update_state("clipboardUpdate", data)
         await self.parent_server._fire_event("clipboardUpdate", data, self.handler_id)
 
     async def start_outgoing_file_transfer(self, file_path, file_name, file_size, mime_type, checksum):
         transfer_id = str(uuid.uuid4())
-        chunk_size = 64 * 1024
+        binary_chunks = "fileChunkBin" in self.capabilities
+        chunk_size = _BINARY_CHUNK_SIZE if binary_chunks else _TEXT_CHUNK_SIZE
         total_chunks = (file_size + chunk_size - 1) // chunk_size
         self.file_transfers[transfer_id] = {"ack_events": {i: asyncio.Event() for i in range(total_chunks)}, "verified_event": asyncio.Event()}
         logging.info(f"Handler {self.handler_id}: Starting outgoing transfer {transfer_id} ({file_name}, {total_chunks} chunks)")
         try:
             await self.send({"type": "fileTransferInit", "data": {"id": transfer_id, "name": file_name, "size": file_size, "mime": mime_type, "checksum": checksum,}})
-            def read_chunks():
-                with open(file_path, "rb") as f:
-                    while chunk := f.read(chunk_size): yield chunk
-            chunk_reader = await asyncio.to_thread(read_chunks)
-            for index, chunk_data in enumerate(chunk_reader):
-                chunk_b64 = await asyncio.to_thread(base64.b64encode, chunk_data)
-                await self.send({"type": "fileChunk", "data": {"id": transfer_id, "index": index, "chunk": chunk_b64.decode('utf-8')}})
-                try:
-                    await asyncio.wait_for(self.file_transfers[transfer_id]["ack_events"][index].wait(), timeout=10.0)
-                except asyncio.TimeoutError:
-                    logging.error(f"Handler {self.handler_id}: Timed out waiting for ack on chunk {index}")
-                    raise Exception("File transfer timed out")
+            if binary_chunks:
+                id_bytes = transfer_id.encode('utf-8')
+                chunk_header = bytes((_FRAME_FILE_CHUNK, len(id_bytes))) + id_bytes
+            else:
+                # Only the index and payload change per chunk, so build the JSON envelope by hand.
+                chunk_prefix = f'{{"type":"fileChunk","data":{{"id":"{transfer_id}","index":'.encode('utf-8')
+            with open(file_path, "rb") as f:
+                for index, chunk_data in enumerate(_iter_file_chunks(f, chunk_size)):
+                    if binary_chunks:
+                        await self.send_binary(chunk_header + _CHUNK_INDEX.pack(index) + chunk_data)
+                    else:
+                        chunk_b64 = _b64encode(chunk_data)
+                        await self.send_prepared(b"".join((chunk_prefix, str(index).encode('ascii'), b',"chunk":"', chunk_b64, b'"}}')))
+                    try:
+                        ack_timeout = _ACK_TIMEOUT_BASE + len(chunk_data) / _ACK_MIN_BYTES_PER_SEC
+                        await asyncio.wait_for(self.file_transfers[transfer_id]["ack_events"][index].wait(), timeout=ack_timeout)
+                    except asyncio.TimeoutError:
+                        logging.error(f"Handler {self.handler_id}: Timed out waiting for ack on chunk {index}")
+                        raise Exception("File transfer timed out")
             await self.send({"type": "fileTransferComplete", "data": {"id": transfer_id, "name": file_name, "size": file_size, "checksum": checksum}})
             try:
                 await asyncio.wait_for(self.file_transfers[transfer_id]["verified_event"].wait(), timeout=30.0)
@@ -172,31 +340,78 @@ class WebSocketHandler:
     async def handle_fileTransferInit(self, data):
         tf_id = data.get("id")
         try:
-            temp_file = await asyncio.to_thread(tempfile.NamedTemporaryFile, delete=False, prefix="airsync_")
-            self.file_transfers[tf_id] = {"meta": data, "path": temp_file.name, "handle": temp_file, "hash": hashlib.sha256()}
             logging.info(f"Handler {self.handler_id}: Receiving file: {data.get('name')}")
-            await self.parent_server._fire_event("fileTransferInit", data, self.handler_id)
+            # The event handler may return a directory to receive straight into (as a unique
+            # "<name>.*.part", renamed once verified); otherwise the file lands in a temp file for the app to move.
+            download_dir = await self.parent_server._fire_event("fileTransferInit", data, self.handler_id)
+            if download_dir:
+                name = os.path.basename(data.get("name") or tf_id)
+                final_path = os.path.join(download_dir, name)
+                # mkstemp uses O_EXCL, so concurrent transfers of the same name never share a file.
+                fd, path = await asyncio.to_thread(tempfile.mkstemp, dir=download_dir, prefix=name + ".", suffix=".part")
+                if hasattr(os, "fchmod"):
+                    await asyncio.to_thread(os.fchmod, fd, 0o666 & ~_UMASK)
+            else:
+                final_path = None
+                fd, path = await asyncio.to_thread(tempfile.mkstemp, prefix="airsync_")
+            self.file_transfers[tf_id] = {"meta": data, "path": path, "final_path": final_path, "fd": fd, "pending": [], "pending_bytes": 0, "received": 0, "next_index": 0}
+            if data.get("size") and hasattr(os, "posix_fallocate"):
+                # Reserve the extents up front; the file is trimmed to the received length on completion.
+                try: await asyncio.to_thread(os.posix_fallocate, fd, 0, int(data["size"]))
+                except OSError as e: logging.debug(f"posix_fallocate unavailable for transfer {tf_id}: {e}")
         except Exception as e:
-            logging.error(f"Failed to open temp file for transfer {tf_id}: {e}")
+            logging.error(f"Failed to open file for transfer {tf_id}: {e}")
             if tf_id in self.file_transfers:
-                await asyncio.to_thread(self.file_transfers[tf_id]['handle'].close)
-                if await asyncio.to_thread(os.path.exists, self.file_transfers[tf_id]['path']):
-                    await asyncio.to_thread(os.remove, self.file_transfers[tf_id]['path'])
-                del self.file_transfers[tf_id]
+                await asyncio.to_thread(_discard_incoming, self.file_transfers.pop(tf_id))
 
     async def handle_fileChunk(self, data):
         tf_id = data.get("id")
         if tf_id in self.file_transfers:
             try:
-                chunk_data = await asyncio.to_thread(base64.b64decode, data.get("chunk", ""))
-                transfer = self.file_transfers[tf_id]
-                await asyncio.to_thread(transfer["handle"].write, chunk_data)
-                transfer["hash"].update(chunk_data)
-            except Exception as e:
-                logging.error(f"Failed to write file chunk for {tf_id}: {e}")
+                chunk_data = _b64decode(data.get("chunk", ""))
+            except binascii.Error as e:
+                logging.error(f"Failed to decode file chunk for {tf_id}: {e}")
+                return
+            await self._write_chunk(tf_id, chunk_data)
         else:
             logging.warning(f"Handler {self.handler_id}: Received chunk for unknown transfer ID {tf_id}")
 
+    async def handle_binary_frame(self, frame):
+        if frame[0] != _FRAME_FILE_CHUNK:
+            logging.warning(f"Handler {self.handler_id}: Received binary frame with unknown tag {frame[0]}.")
+            return
+        id_end = 2 + (frame[1] if len(frame) > 1 else 0)
+        if len(frame) < id_end + _CHUNK_INDEX.size:
+            logging.warning(f"Handler {self.handler_id}: Dropping truncated binary chunk frame ({len(frame)} bytes).")
+            return
+        tf_id = frame[2:id_end].decode('utf-8', 'replace')
+        transfer = self.file_transfers.get(tf_id)
+        if transfer is None or "fd" not in transfer:
+            logging.warning(f"Handler {self.handler_id}: Received chunk for unknown transfer ID {tf_id}")
+            return
+        (index,) = _CHUNK_INDEX.unpack_from(frame, id_end)
+        if index != transfer["next_index"]:
+            logging.warning(f"Handler {self.handler_id}: Dropping chunk {index} for {tf_id}; expected {transfer['next_index']}.")
+            return
+        transfer["next_index"] += 1
+        await self._write_chunk(tf_id, frame[id_end + _CHUNK_INDEX.size:])
+
+    async def _write_chunk(self, tf_id, chunk_data):
+        try:
+            transfer = self.file_transfers[tf_id]
+            transfer["pending"].append(chunk_data)
+            transfer["pending_bytes"] += len(chunk_data)
+            transfer["received"] += len(chunk_data)
+            if len(transfer["pending"]) >= _WRITE_BATCH_CHUNKS or transfer["pending_bytes"] >= _WRITE_BATCH_BYTES:
+                await self._flush_chunks(transfer)
+        except Exception as e:
+            logging.error(f"Failed to write file chunk for {tf_id}: {e}")
+
+    async def _flush_chunks(self, transfer):
+        pending, transfer["pending"], transfer["pending_bytes"] = transfer["pending"], [], 0
+        if pending:
+            await asyncio.to_thread(_write_chunks, transfer["fd"], pending)
+
     async def handle_fileChunkAck(self, data):
         transfer_id, index = data.get("id"), data.get("index")
         if transfer_id in self.file_transfers and "ack_events" in self.file_transfers[transfer_id]:
@@ -207,19 +422,46 @@ class WebSocketHandler:
             
     async def handle_fileTransferComplete(self, data):
         tf_id = data.get("id")
-        if tf_id in self.file_transfers:
-            transfer = self.file_transfers[tf_id]
-            await asyncio.to_thread(transfer["handle"].close)
-            final_hash, doc_hash, verified = transfer["hash"].hexdigest(), data.get("checksum"), True
-            if doc_hash and doc_hash != "null":
+        # Only incoming transfers hold an fd; an outgoing id here is treated as unknown.
+        if "fd" in self.file_transfers.get(tf_id, {}):
+            # Detach first so the disconnect cleanup never touches an fd we have closed.
+            transfer = self.file_transfers.pop(tf_id)
+            def finish_file():
+                os.ftruncate(transfer["fd"], transfer["received"])
+                # Hash the finished file in one pass instead of per chunk as it arrives.
+                return file_sha256(transfer["fd"])
+            try:
+                await self._flush_chunks(transfer)
+                final_hash = await asyncio.to_thread(finish_file)
+            except Exception as e:
+                # Still report the failure below so neither side waits on a transfer that is gone.
+                logging.error(f"Failed to finish incoming file {tf_id}: {e}")
+                final_hash = None
+            finally:
+                os.close(transfer["fd"])
+            doc_hash, verified = data.get("checksum"), final_hash is not None
+            if verified and doc_hash and doc_hash != "null":
                 if final_hash == doc_hash: logging.info(f"File checksum VERIFIED for {tf_id}: {final_hash}")
                 else: logging.warning(f"File checksum MISMATCH for {tf_id}! Doc: {doc_hash}, Got: {final_hash}"); verified = False
-            else: logging.info(f"No checksum provided for {tf_id}, assuming verified.")
+            elif verified: logging.info(f"No checksum provided for {tf_id}, assuming verified.")
             logging.info(f"Handler {self.handler_id}: File transfer complete: {data.get('name')}")
-            data["temp_path"], data["verified"] = transfer["path"], verified
+            if final_hash is None:
+                _remove_quietly(transfer["path"])
+            elif transfer["final_path"] is None:
+                data["temp_path"] = transfer["path"]
+            elif verified:
+                try:
+                    os.replace(transfer["path"], transfer["final_path"])
+                    data["path"] = transfer["final_path"]
+                except OSError as e:
+                    logging.error(f"Failed to finalize {transfer['final_path']}: {e}")
+                    _remove_quietly(transfer["path"])
+                    verified = False
+            else:
+                _remove_quietly(transfer["path"])
+            data["verified"] = verified
             await self.parent_server._fire_event("fileTransferComplete", data, self.handler_id)
             await self.send({"type": "transferVerified", "data": {"id": tf_id, "verified": verified}})
-            del self.file_transfers[tf_id]
         else:
             logging.warning(f"Handler {self.handler_id}: Received complete for unknown transfer ID {tf_id}")
 
@@ -233,4 +475,23 @@ class WebSocketHandler:
             logging.info(f"Handler {self.handler_id}: File transfer verified by device: {data}")
 
     async def handle_unknown(self, data):
-        logging.warning(f"Handler {self.handler_id}: Received unknown message type.")
\ No newline at end of file
+        logging.warning(f"Handler {self.handler_id}: Received unknown message type.")
+
+    # Built once at class creation so listen() does a single dict lookup per message.
+    _DISPATCH = {
+        "device": handle_device,
+        "status": handle_status,
+        "notification": handle_notification,
+        "notificationActionResponse": handle_notificationActionResponse,
+        "notificationUpdate": handle_notificationUpdate,
+        "dismissalResponse": handle_dismissalResponse,
+        "mediaControlResponse": handle_mediaControlResponse,
+        "macMediaControl": handle_macMediaControl,
+        "appIcons": handle_appIcons,
+        "clipboardUpdate": handle_clipboardUpdate,
+        "fileTransferInit": handle_fileTransferInit,
+        "fileChunk": handle_fileChunk,
+        "fileChunkAck": handle_fileChunkAck,
+        "fileTransferComplete": handle_fileTransferComplete,
+        "transferVerified": handle_transferVerified,
+    }
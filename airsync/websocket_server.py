@@ -4,41 +4,52 @@ from websockets.exceptions import ConnectionClosed
 from .websocket_handler import WebSocketHandler
 
 class WebSocketServer:
-    def __init__(self, state, cipher, parent_server, icon_cache_path):
+    def __init__(self, state, cipher, parent_server, icon_cache_path, max_size=100 * 1024 * 1024):
         self.state = state
         self.cipher = cipher
         self.parent_server = parent_server
         self.icon_cache_path = icon_cache_path
+        # The appIcons handshake frame carries every icon as Base64 (encoded twice in legacy text
+        # mode), so the default stays generous; applications may lower it via Server(max_message_size=...).
+        self.max_size = max_size
         self.server = None
-        self.handlers = set()
+        self.handlers = {}  # {handler_id: WebSocketHandler}
+        self.authenticated = {}  # Subset of `handlers` that completed the 'device' handshake
         self.host = "0.0.0.0"
         self.port = 5297
         self.no_encrypt = False
 
     async def _handler_wrapper(self, websocket: WebSocketServerProtocol):
-        handler = WebSocketHandler(websocket=websocket, state=self.state, cipher=self.cipher, no_encrypt=self.no_encrypt, parent_server=self.parent_server, icon_cache_path=self.icon_cache_path)
-        self.handlers.add(handler)
+        # Handlers are deliberately not pooled: callers (e.g. Server.send_file) may still hold one after its
+        # socket closes, and a recycled instance would route their sends to a different device.
+        handler = WebSocketHandler(websocket=websocket, state=self.state, cipher=self.cipher, no_encrypt=self.no_encrypt, parent_server=self.parent_server, icon_cache_path=self.icon_cache_path, ws_server=self)
+        self.handlers[handler.handler_id] = handler
         try:
             await handler.listen()
         except ConnectionClosed as e:
-            logging.info(f"Connection closed: {websocket.remote_address} (Code: {e.code})")
+            logging.info("Connection closed: %s (Code: %s)", websocket.remote_address, e.code)
         except Exception as e:
-            logging.error(f"Error in handler for {websocket.remote_address}: {e}", exc_info=True)
+            logging.error("Error in handler for %s: %s", websocket.remote_address, e, exc_info=True)
         finally:
-            if handler in self.handlers:
-                self.handlers.remove(handler)
-            await self.parent_server._fire_event("device_disconnected", handler.handler_id)
-            logging.info(f"Device disconnected: {websocket.remote_address}. Total handlers: {len(self.handlers)}")
+            self.handlers.pop(handler.handler_id, None)
+            self.unmark_authenticated(handler)
+            logging.info("Device disconnected: %s. Total handlers: %d", websocket.remote_address, len(self.handlers))
+            # Don't hold up connection teardown on the user's callback.
+            self.parent_server._fire_event_nowait("device_disconnected", handler.handler_id)
 
     async def start(self):
         if self.server:
             logging.warning("WebSocket server is already running.")
             return
-        logging.info(f"Starting WebSocket server on {self.host}:{self.port}...")
+        logging.info("Starting WebSocket server on %s:%s...", self.host, self.port)
         try:
-            self.server = await serve(self._handler_wrapper, self.host, self.port, max_size=100 * 1024 * 1024)
+            # Compression off: frames are mostly ciphertext, which deflate can't shrink anyway.
+            # This stays on the legacy serve(): handlers rely on its protocol object (ws.closed,
+            # WebSocketServerProtocol), and requirements.txt doesn't pin a websockets version that has
+            # websockets.asyncio.server.
+            self.server = await serve(self._handler_wrapper, self.host, self.port, compression=None, max_size=self.max_size)
         except Exception as e:
-            logging.critical(f"Failed to start WebSocket server: {e}", exc_info=True)
+            logging.critical("Failed to start WebSocket server: %s", e, exc_info=True)
             raise
 
     async def stop(self):
@@ -47,27 +58,47 @@ class WebSocketServer:
             await self.server.wait_closed()
             self.server = None
             logging.info("WebSocket server stopped.")
-        for handler in list(self.handlers):
-            await handler.close()
+        handlers = list(self.handlers.values())
         self.handlers.clear()
+        self.authenticated.clear()
+        if handlers:
+            await asyncio.gather(*(h.close() for h in handlers), return_exceptions=True)
 
-    async def send_to_handler(self, handler_id: str, message_dict: dict):
-        found_handler = next((h for h in self.handlers if h.handler_id == handler_id), None)
-        if found_handler and found_handler.is_authenticated:
+    def mark_authenticated(self, handler):
+        self.authenticated[handler.handler_id] = handler
+
+    def unmark_authenticated(self, handler):
+        self.authenticated.pop(handler.handler_id, None)
+
+    async def send_to_handler(self, handler_id: int, message_dict: dict):
+        found_handler = self.authenticated.get(handler_id)
+        if found_handler:
             await found_handler.send(message_dict)
         else:
-            logging.warning(f"Could not send message: Handler {handler_id} not found or not authenticated.")
+            logging.warning("Could not send message: Handler %s not found or not authenticated.", handler_id)
 
-    def get_handler(self, handler_id: str):
-        return next((h for h in self.handlers if h.handler_id == handler_id), None)
+    def get_handler(self, handler_id: int):
+        return self.handlers.get(handler_id)
 
     async def broadcast(self, message_dict: dict):
-        if not self.handlers:
+        if not self.authenticated:
             return
-        tasks = [asyncio.create_task(h.send(message_dict)) for h in self.handlers if h.is_authenticated]
-        if not tasks:
+        # Serialize once; each handler still encrypts separately so every frame gets its own nonce.
+        try:
+            payload = WebSocketHandler.encode(message_dict)
+        except (TypeError, ValueError) as e:
+            logging.error("Cannot broadcast message: %s", e)
             return
+        coros = [h.send_prepared(payload) for h in self.authenticated.values()]
         try:
-            await asyncio.wait(tasks, timeout=5)
+            results = await asyncio.wait_for(asyncio.gather(*coros, return_exceptions=True), timeout=5)
+        except asyncio.TimeoutError:
+            logging.warning("Broadcast timed out after 5 seconds.")
+            return
         except Exception as e:
-            logging.error(f"Error during broadcast: {e}", exc_info=True)
\ No newline at end of file
+            # Per-handler failures come back in the gather results; only gather itself can land here.
+            logging.error("Error during broadcast: %s", e)
+            return
+        for result in results:
+            if isinstance(result, Exception):
+                logging.warning("Broadcast to a handler failed: %s", result)
\ No newline at end of file
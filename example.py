@@ -1,8 +1,13 @@
-import airsync, asyncio, logging, os, platform, pyperclip, shutil
+import airsync, asyncio, logging, os, platform, pyperclip, signal
 from notifypy import Notify
 from pathlib import Path
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 CURRENT_HANDLER_ID = None
+LAST_BATTERY = None
 logging.getLogger().setLevel(logging.INFO)
 CACHE_DIR = "cache"
 ICON_CACHE_DIR = os.path.join(CACHE_DIR, "icons")
@@ -10,19 +15,36 @@ DOWNLOADS_DIR = Path.home() / "Downloads"
 os.makedirs(ICON_CACHE_DIR, exist_ok=True)
 os.makedirs(DOWNLOADS_DIR, exist_ok=True) 
 
+# One Notify instance reused for every notification; constructing it probes the OS backend each time.
+_NOTIFY = Notify()
+_DEFAULT_NOTIFY_ICON = _NOTIFY.icon
+
+def _scan_icon_cache():
+    return {name[:-4] for name in os.listdir(ICON_CACHE_DIR) if name.endswith(".png")}
+
+# Latest clipboard text waiting to be copied; bursts collapse to the newest entry.
+_CLIPBOARD_QUEUE = asyncio.Queue(maxsize=1)
+
+# Packages with a cached icon, so notifications don't stat the cache dir every time.
+_ICON_PACKAGES = _scan_icon_cache()
+
 server = airsync.Server(
     key_path=os.path.join(CACHE_DIR, "airsync.key"),
     icon_cache_path=ICON_CACHE_DIR,
     discovery=True
 )
 
+# Static for the life of the process, so build it once.
+_MAC_INFO = {
+    "name": platform.node(), "categoryType": "PC", "exactDeviceName": "My PC",
+    "model": "AirSync-Py", "type": "PC", "isPlus": True, "isPlusSubscription": True,
+}
+
 @server.on_event("mac_info_request")
 async def provide_mac_info(handler_id, device_info):
     logging.info(f"Device '{device_info.get('name')}' requesting macInfo.")
-    return {
-        "name": platform.node(), "categoryType": "PC", "exactDeviceName": "My PC",
-        "model": "AirSync-Py", "type": "PC", "isPlus": True, "isPlusSubscription": True,
-    }
+    # Shallow copy: the library adds per-connection fields (savedAppPackages, capabilities).
+    return _MAC_INFO.copy()
 
 '''
 async def send_file_task(handler_id):
@@ -53,78 +75,87 @@ async def on_disconnect(handler_id):
 
 @server.on_event("notification")
 async def on_notification(data, handler_id):
-    logging.info(f"Notification: {data.get('app')} - {data.get('title')}")
-    notification = Notify()
-    notification.application_name = data.get('app')
-    notification.title = data.get('title')
-    notification.message = data.get('body')
+    logging.info("Notification: %s - %s", data.get('app'), data.get('title'))
+    # No await between filling in the shared instance and send(), so concurrent calls can't interleave.
+    _NOTIFY.application_name = data.get('app')
+    _NOTIFY.title = data.get('title')
+    _NOTIFY.message = data.get('body')
+    _NOTIFY.icon = _DEFAULT_NOTIFY_ICON
     package_name = data.get('package')
-    if package_name:
-        icon_path = os.path.join(ICON_CACHE_DIR, f"{package_name}.png")
-        if os.path.exists(icon_path):
-            notification.icon = icon_path
-    notification.send()
+    if package_name in _ICON_PACKAGES:
+        _NOTIFY.icon = os.path.join(ICON_CACHE_DIR, f"{package_name}.png")
+    _NOTIFY.send()
 
-@server.on_event("appIcons")
+@server.on_event("app_icons")
 async def on_app_icons(data, handler_id):
     logging.info(f"Received metadata for {len(data)} app icons.")
+    # Fired after the library has written any new icons to the cache.
+    _ICON_PACKAGES.update(_scan_icon_cache())
 
 @server.on_event("status")
 async def on_status(data, handler_id):
+    global LAST_BATTERY
     if "battery" in data:
-        logging.info(f"Battery: {data['battery'].get('level')}% (Charging: {data['battery'].get('isCharging')})")
+        battery = (data['battery'].get('level'), data['battery'].get('isCharging'))
+        if battery != LAST_BATTERY:
+            LAST_BATTERY = battery
+            logging.info("Battery: %s%% (Charging: %s)", *battery)
     if "music" in data and data['music'].get('title'):
         music = data['music']
-        logging.info(f"Music: {music.get('title')} - {music.get('artist')}")
+        logging.info("Music: %s - %s", music.get('title'), music.get('artist'))
 
 @server.on_event("clipboardUpdate")
 async def on_clipboard(data, handler_id):
     text = data.get('text')
-    logging.info(f"Phone clipboard updated: {text[:50]}...")
-    pyperclip.copy(text)
+    logging.info("Phone clipboard updated: %.50s...", text)
+    if text is None:
+        return
+    if _CLIPBOARD_QUEUE.full():
+        _CLIPBOARD_QUEUE.get_nowait()
+    _CLIPBOARD_QUEUE.put_nowait(text)
+
+async def clipboard_writer():
+    # pyperclip shells out to pbcopy/xclip/wl-copy, so keep it off the event loop.
+    while True:
+        text = await _CLIPBOARD_QUEUE.get()
+        try:
+            await asyncio.to_thread(pyperclip.copy, text)
+        except Exception as e:
+            logging.error(f"Failed to copy to clipboard: {e}")
 
 @server.on_event("fileTransferInit")
 async def on_file_init(data, handler_id):
     logging.info(f"Receiving file: {data.get('name')} ({data.get('size')} bytes)")
+    # Receive straight into Downloads; the library renames the .part file once it is verified.
+    return DOWNLOADS_DIR
 
 @server.on_event("fileTransferComplete")
 async def on_file_complete(data, handler_id):
-    temp_path = data.get("temp_path")
-    final_name = data.get("name")
-    
-    if not temp_path or not final_name or not data.get("verified") or not os.path.exists(temp_path):
-        logging.error(f"File transfer failed or was incomplete for: {final_name}")
-        if temp_path and os.path.exists(temp_path):
-             await asyncio.to_thread(os.remove, temp_path)
-        return
-
-    final_name = os.path.basename(final_name)
-    dest_path = os.path.join(DOWNLOADS_DIR, final_name)
-    
-    try:
-        await asyncio.to_thread(shutil.move, temp_path, dest_path)
-        logging.info(f"File transfer complete. Saved to: {dest_path}")
-    except Exception as e:
-        logging.error(f"Failed to move completed file: {e}")
-        await asyncio.to_thread(os.remove, temp_path)
-
-async def background_task():
-    while True:
-        await asyncio.sleep(30)
-        
-        state = server.get_state()
-        if state.get('status', {}).get('battery'):
-            logging.debug(f"BG Task: Battery is {state['status']['battery']['level']}%")
+    if data.get("verified") and data.get("path"):
+        logging.info(f"File transfer complete. Saved to: {data['path']}")
+    else:
+        logging.error(f"File transfer failed or was incomplete for: {data.get('name')}")
 
 async def main():
-    asyncio.create_task(background_task())
     server.print_qr_code() 
     
     logging.info("Starting AirSync server... Press Ctrl+C to stop.")
-    await server.start(port=5297)
+    async with asyncio.TaskGroup() as tg:
+        clipboard_task = tg.create_task(clipboard_writer())
+        server_task = tg.create_task(server.start(port=5297))
+        # However the server ends, take the clipboard writer down with it.
+        server_task.add_done_callback(lambda _: clipboard_task.cancel())
+        # Cancelling the server task makes Server.start() run its own stop() before returning.
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, server_task.cancel)
+            except NotImplementedError:
+                pass  # Windows: Ctrl+C still arrives as KeyboardInterrupt below.
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        # uvloop is a drop-in, faster event loop; fall back to asyncio's default when it isn't installed.
+        (uvloop.run if uvloop else asyncio.run)(main())
     except KeyboardInterrupt:
         logging.info("Server shutting down...")
\ No newline at end of file